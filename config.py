@@ -1,10 +1,15 @@
 import os
+from functools import lru_cache
 from typing import Optional
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+@lru_cache(maxsize=None)
+def load_env() -> None:
+    """Load environment variables from the .env file (parsed once per process)"""
+    load_dotenv()
+
+load_env()
 
 # Database Configuration
 class DatabaseConfig:
@@ -13,16 +18,29 @@ class DatabaseConfig:
     HOST: str = os.getenv("DB_HOST", "147.79.117.38")
     PORT: str = os.getenv("DB_PORT", "38028")
     NAME: str = os.getenv("DB_NAME", "auto_publisher_db")
+    # Connection pool sizing; keep POOL_SIZE + MAX_OVERFLOW below Postgres max_connections
+    POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "20"))
+    MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "30"))
+    POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "3600"))
     
     @property
     def DATABASE_URL(self) -> str:
-        return f"postgresql://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.NAME}"
+        return f"postgresql+psycopg2://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.NAME}"
+    
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return f"postgresql+asyncpg://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.NAME}"
 
 # Application Settings
 class AppConfig:
     IMAGES_SAVE_DIR: Path = Path(os.getenv("IMAGES_SAVE_DIR", "/var/www/images"))
     WATERMARK_IMAGE_PATH: Path = Path(os.getenv("WATERMARK_IMAGE_PATH", "./watermark/watermark.png"))
     IMAGE_PORT: int = int(os.getenv("IMAGE_PORT", "8021"))
+    # libwebp encoder effort (0=fast ... 6=smallest); 4 is libwebp's default and much cheaper than 6
+    WEBP_METHOD: int = int(os.getenv("WEBP_METHOD", "4"))
+    # Largest image download accepted; bounds the buffer preallocated from Content-Length
+    MAX_IMAGE_BYTES: int = int(os.getenv("MAX_IMAGE_BYTES", str(25 * 1024 * 1024)))
 
 # Logging Configuration
 class LoggingConfig:
@@ -35,17 +53,25 @@ class Config:
     app = AppConfig()
     log = LoggingConfig()
     
+    _values: dict = {}
+    
+    @classmethod
+    def _build_index(cls) -> None:
+        """Snapshot every setting into a flat {'db.USER': ...} dict so get() is a single lookup"""
+        cls._values = {}
+        for section_name in ('db', 'app', 'log'):
+            section = getattr(cls, section_name)
+            for attr in dir(type(section)):
+                if attr.isupper():
+                    cls._values[f"{section_name}.{attr}"] = getattr(section, attr)
+    
     @classmethod
     def get(cls, key: str, default: Optional[str] = None) -> str:
         """Get any configuration value by dot notation (e.g., 'db.USER' or 'app.IMAGE_PORT')"""
-        try:
-            parts = key.split('.')
-            value = cls
-            for part in parts:
-                value = getattr(value, part)
-            return value if value is not None else default
-        except (AttributeError, TypeError):
-            return default
+        value = cls._values.get(key)
+        return value if value is not None else default
+
+Config._build_index()
 
 # Create a single config instance to be imported
 global_config = Config()
@@ -1,63 +1,60 @@
-from sqlalchemy import create_engine
+import asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
-import os
-from dotenv import load_dotenv
+from config import global_config as config
 
-# Load environment variables
-load_dotenv()
+# Database configuration (environment is loaded once by config)
+DB_HOST = config.db.HOST
+DB_PORT = config.db.PORT
+DB_NAME = config.db.NAME
 
-# Database configuration from environment variables
-DB_USER = os.getenv('DB_USER', 'postgres')
-DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
-DB_HOST = os.getenv('DB_HOST', 'localhost')
-DB_PORT = os.getenv('DB_PORT', '5432')
-DB_NAME = os.getenv('DB_NAME', 'image-scraper')
+# Construct the database URL (asyncpg driver)
+DATABASE_URL = config.db.ASYNC_DATABASE_URL
 
-# Construct the database URL
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-# Create SQLAlchemy engine
-engine = create_engine(
+# Create async SQLAlchemy engine
+engine = create_async_engine(
     DATABASE_URL,
-    pool_pre_ping=True,  # Enable connection health checks
-    pool_size=5,         # Number of connections to keep open
-    max_overflow=10,     # Number of connections to create beyond pool_size when needed
-    echo=False           # Set to True for SQL query logging
+    pool_pre_ping=True,                    # Enable connection health checks
+    pool_size=config.db.POOL_SIZE,         # Number of connections to keep open
+    max_overflow=config.db.MAX_OVERFLOW,   # Number of connections to create beyond pool_size when needed
+    pool_timeout=config.db.POOL_TIMEOUT,   # Seconds to wait for a free connection before giving up
+    pool_recycle=config.db.POOL_RECYCLE,   # Recycle connections older than this many seconds
+    echo=False                             # Set to True for SQL query logging
 )
 
-# Create a scoped session factory
-SessionLocal = scoped_session(
-    sessionmaker(
-        autocommit=False,
-        autoflush=False,
-        bind=engine
-    )
+# Create an async session factory; objects stay usable after commit so no implicit IO is needed
+AsyncSessionLocal = async_sessionmaker(
+    engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
 )
 
 # Base class for models
 Base = declarative_base()
 
-def get_db():
-    """Dependency for getting DB session"""
-    db = SessionLocal()
-    try:
+async def get_db():
+    """Dependency for getting an async DB session"""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def init_db():
+async def init_db():
     """Initialize the database by creating all tables"""
     import models  # Import models to ensure they're registered with SQLAlchemy
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     print(f"Database '{DB_NAME}' initialized successfully at {DB_HOST}:{DB_PORT}")
 
 # For testing the connection
 if __name__ == "__main__":
-    try:
+    async def _check_connection():
         # Test the connection
-        with engine.connect() as conn:
+        async with engine.connect() as conn:
             print(f"Successfully connected to database: {DB_NAME}")
-        init_db()
+        await init_db()
+        await engine.dispose()
+
+    try:
+        asyncio.run(_check_connection())
     except Exception as e:
         print(f"Error connecting to database: {e}")
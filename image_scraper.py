@@ -1,16 +1,176 @@
-from PIL import Image, ImageFile, ImageEnhance
+# PIL and aiohttp are imported inside the functions that use them so importing this
+# module (and starting the API) does not pay for them up front
 import io
-import aiohttp
+import asyncio
 import os
 import re
-import random
-import tempfile
+import html
+import importlib.util
+from pathlib import Path
+import secrets
 import logging
-import traceback
 import json
-from bs4 import BeautifulSoup
+import multiprocessing
+try:
+    import orjson
+    _json_loads = orjson.loads  # orjson.JSONDecodeError subclasses json.JSONDecodeError
+except ImportError:
+    _json_loads = json.loads
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from config import global_config as config
+
+logger = logging.getLogger(__name__)
+
+# Characters allowed in generated image filenames
+_SAFE_NAME_RE = re.compile(r'[^a-zA-Z0-9]')
+
+# Bundled watermark used when WATERMARK_IMAGE_PATH is unset or missing
+_DEFAULT_WATERMARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'watermark', 'spreadword.webp')
+
+# Shared pool for the CPU-bound PIL work, created on first use
+_process_pool = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the process pool used to decode/watermark/encode images, creating it if needed"""
+    global _process_pool
+    if _process_pool is None:
+        # The pool is created from a request, after the default executor's threads exist;
+        # fork()ing a multi-threaded process can deadlock the children, so start them cleanly
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                            mp_context=multiprocessing.get_context(method))
+    return _process_pool
+
+def shutdown_process_pool() -> None:
+    """Shut down the shared image process pool (call on application shutdown)"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
+
+def _discard_broken_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a pool whose worker died so the next get_process_pool() starts a fresh one"""
+    global _process_pool
+    if _process_pool is pool:  # Concurrent saves on the same broken pool only reset it once
+        _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+async def _run_in_process_pool(fn, *args):
+    """
+    Run fn(*args) in the shared process pool.
+    
+    A worker killed mid-task (OOM, segfault, SIGILL) breaks the whole pool, so the
+    pool is replaced and the call retried once; a second failure only fails this call.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        logger.warning("Image process pool is broken (a worker died); restarting it and retrying once")
+        _discard_broken_pool(pool)
+        return await loop.run_in_executor(get_process_pool(), fn, *args)
+
+# Watermark paths that passed _watermark_is_valid; failures aren't remembered so a file that
+# was briefly unreadable (e.g. on the mounted volume) is picked up again by the next scraper
+_valid_watermarks = set()
+
+def _watermark_is_valid(watermark_path: str) -> bool:
+    """Check once per process that the watermark can be read, so workers never retry a bad file per image"""
+    from PIL import Image
+    if watermark_path in _valid_watermarks:
+        return True
+    try:
+        with Image.open(watermark_path) as watermark:
+            watermark.verify()
+    except Exception as e:
+        logger.error("Watermark %s is not a readable image: %s", watermark_path, e)
+        return False
+    _valid_watermarks.add(watermark_path)
+    return True
+
+@lru_cache(maxsize=4)
+def _load_watermark(watermark_path: str):
+    """Decode a watermark once per process and return (rgba_image, alpha_mask)"""
+    from PIL import Image
+    with Image.open(watermark_path) as watermark:
+        watermark = watermark.convert('RGBA')
+    return watermark, watermark.getchannel('A')
+
+@lru_cache(maxsize=32)
+def _scaled_watermark(watermark_path: str, max_width: int):
+    """Return (rgba_image, alpha_mask) for the watermark scaled down to max_width, cached per width"""
+    from PIL import Image
+    
+    watermark, alpha = _load_watermark(watermark_path)
+    if watermark.width > max_width:
+        height = max(1, round(watermark.height * max_width / watermark.width))
+        watermark = watermark.resize((max_width, height), Image.LANCZOS)
+        alpha = watermark.getchannel('A')
+    return watermark, alpha
+
+def _add_watermark(img, watermark_path: str):
+    """Paste the cached watermark onto the bottom-right corner of an RGB image and return it (callers convert other modes first)"""
+    # Keep the watermark at most a quarter of the image width
+    watermark, alpha = _scaled_watermark(watermark_path, max(1, img.width // 4))
+    margin = max(10, img.width // 50)
+    position = (max(0, img.width - watermark.width - margin), max(0, img.height - watermark.height - margin))
+    img.paste(watermark, position, alpha)
+    return img
+
+def _encode_and_watermark(img_bytes: bytearray, watermark_path: str, out_path: str) -> None:
+    """
+    Decode img_bytes, flatten transparency, apply the watermark and write WebP to out_path.
+    
+    Runs inside the process pool, so it only takes picklable arguments.
+    """
+    from PIL import Image, ImageFile
+    
+    # Decode what arrived of a truncated download instead of failing after the bytes were paid for
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+    
+    with Image.open(io.BytesIO(img_bytes)) as img:
+        logger.debug("[_encode_and_watermark] Opened image with mode: %s, size: %s", img.mode, img.size)
+        
+        # Convert to RGB if necessary (for PNG with transparency)
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            if img.mode == 'P':
+                img = img.convert('RGBA')  # Palette transparency has no 'A' band to read
+            alpha = img.getchannel('A')  # Only the alpha band, unlike split()
+            if alpha.getextrema()[0] == 255:
+                # Fully opaque: no need to composite over white
+                img = img.convert('RGB')
+            else:
+                logger.debug("[_encode_and_watermark] Converting image from transparent to RGB")
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=alpha)  # Paste using alpha channel as mask
+                img = background
+        elif img.mode != 'RGB':
+            # L/P/CMYK/...: paste() would convert the RGBA watermark to this mode and mangle it
+            img = img.convert('RGB')
+        
+        # Composite the (per-process cached) watermark in memory
+        if watermark_path:
+            try:
+                img = _add_watermark(img, watermark_path)
+                logger.debug("[_encode_and_watermark] Successfully applied watermark")
+            except Exception as e:
+                # Continue with unwatermarked image if watermarking fails
+                logger.error("[_encode_and_watermark] Error applying watermark: %s", e, exc_info=True)
+        
+        # Encode straight into the reserved target file
+        img.save(out_path, format='WEBP', quality=65, method=config.app.WEBP_METHOD,
+                 minimize_size=False, save_all=False)
+    
+    # Set proper permissions
+    os.chmod(out_path, 0o644)
 
 class ImageScraper:
+    # Bing result cards look like <a class="iusc" ... m="{&quot;murl&quot;:...}">
+    _M_RE = re.compile(rb'class="iusc"[^>]*?\bm="([^"]+)"')
+
     def __init__(self, profile: str = None, keyword: str = None, max_results: int = 10, max_save: int = 10):
         """
         Initialize the ImageScraper with common parameters.
@@ -27,17 +187,92 @@ class ImageScraper:
         self.max_save = max_save
         self._saved_count = 0  # Counter for saved images
         
-        # Initialize session with headers
-        self.session = requests.Session()
-        self.session.headers.update({
+        # HTTP session is opened by open()/__aenter__ and shared by the Bing search and image downloads
+        self._http = None
+        self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
             "Accept-Language": "en-US,en;q=0.5",
             "Referer": "https://www.bing.com/",
             "DNT": "1",
             "Connection": "keep-alive"
-        })
-    def bing_image_scraper(self, query: str = None, max_results: int = None):
+        }
+        
+        # Resolve paths once per scraper instead of on every saved image
+        self._save_dir = self._format_save_dir(profile)
+        # Resolved off the event loop by open(); worker processes decode and cache it (None when missing)
+        self._watermark_path = None
+
+    @staticmethod
+    def _format_save_dir(profile: str) -> str:
+        """Return the save directory for a profile (IMAGES_SAVE_DIR may contain '{profile}')."""
+        return config.app.IMAGES_SAVE_DIR.as_posix().format(profile=profile)
+
+    @staticmethod
+    def _find_watermark():
+        """Return the watermark path (WATERMARK_IMAGE_PATH, then the bundled default), or None if missing or unreadable (blocking; run in an executor)."""
+        watermark_path = config.app.WATERMARK_IMAGE_PATH
+        if not watermark_path.exists():
+            # Fall back to the default watermark location
+            watermark_path = Path(_DEFAULT_WATERMARK)
+        
+        if not watermark_path.exists():
+            logger.warning("Watermark file not found at: %s", watermark_path)
+            return None
+        if not _watermark_is_valid(str(watermark_path)):
+            return None
+        return str(watermark_path)
+
+    async def open(self):
+        """
+        Open the pooled aiohttp session shared by the Bing search and every image download.
+        
+        Connections are kept alive per host, DNS answers are cached, and DNS lookups go
+        through aiodns when it is installed instead of the blocking getaddrinfo thread pool.
+        Also resolves the watermark, whose file checks run in the default executor.
+        """
+        import aiohttp
+        
+        if self._http is not None:
+            return self
+        
+        self._watermark_path = await asyncio.get_running_loop().run_in_executor(None, self._find_watermark)
+        
+        resolver = None
+        if importlib.util.find_spec("aiodns") is not None:
+            resolver = aiohttp.AsyncResolver()
+        connector = aiohttp.TCPConnector(
+            limit=32,
+            limit_per_host=8,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+            resolver=resolver
+        )
+        self._http = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=60)  # 60 seconds timeout for image downloads
+        )
+        return self
+
+    async def close(self):
+        """Close the HTTP session and its pooled connections."""
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _require_http(self):
+        if self._http is None:
+            raise RuntimeError("ImageScraper is not open; use 'async with ImageScraper(...) as scraper' or await scraper.open()")
+        return self._http
+
+    async def bing_image_scraper(self, query: str = None, max_results: int = None):
         """
         Scrape full-size Bing image URLs.
         
@@ -46,15 +281,17 @@ class ImageScraper:
             max_results: Number of images to fetch (uses self.max_results if None)
         
         Returns:
-            List of image URLs
+            List of unique image URLs, in result order
         """
         query = query or self.keyword
         max_results = max_results or self.max_results
         
+        import aiohttp
+        
         if not query:
             raise ValueError("No search query provided and no default keyword set")
             
-        print(f"\n=== Starting bing_image_scraper with query: {query} ===")
+        logger.debug("[bing_image_scraper] Starting with query: %s", query)
         
         url = "https://www.bing.com/images/search"
         params = {
@@ -65,68 +302,107 @@ class ImageScraper:
             "qft": "+filterui:imagesize-large"  # request large images
         }
         
-        print(f"Making request to: {url}")
-        print(f"Params: {params}")
-        print(f"Using headers from session")
+        logger.debug("[bing_image_scraper] Making request to: %s, params: %s", url, params)
+
+        http = self._require_http()
 
         try:
-            # Make the request using the session
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            print(f"\n=== Response Status: {response.status_code} ===")
-            print(f"Final URL: {response.url}")
-            
-            # Parse the response
-            soup = BeautifulSoup(response.text, "html.parser")
-            
-            # Debug: Print page title
-            title = soup.find('title')
-            print(f"Page title: {title.text if title else 'No title found'}")
-            
-            # Find all image containers
-            image_containers = soup.find_all("a", class_="iusc")
-            print(f"Found {len(image_containers)} image containers")
-            
+            # Make the request using the shared session
+            async with http.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                response.raise_for_status()
+
+                logger.debug("[bing_image_scraper] Response status: %s, final URL: %s", response.status, response.url)
+
+                html_bytes = await response.read()
+
+            # Pull the m="{...}" metadata straight out of each <a class="iusc"> card
             results = []
-            for i, div in enumerate(image_containers):
+            seen = set()  # Bing repeats the same asset across cards
+            for i, m_match in enumerate(self._M_RE.finditer(html_bytes)):
                 try:
-                    m = div.get("m")
-                    if not m:
-                        print(f"No 'm' attribute in container {i}")
-                        continue
-                        
-                    m_json = json.loads(m)
+                    m = html.unescape(m_match.group(1).decode('utf-8', errors='replace'))
+                    m_json = _json_loads(m)
                     img_url = m_json.get("murl")
                     
                     if img_url and img_url.startswith("http"):
-                        print(f"Found image URL: {img_url}")
+                        if img_url in seen:
+                            continue
+                        seen.add(img_url)
+                        logger.debug("[bing_image_scraper] Found image URL: %s", img_url)
                         results.append(img_url)
                         if len(results) >= max_results:
                             break
                 except json.JSONDecodeError as e:
-                    print(f"JSON decode error in container {i}: {e}")
-                    print(f"Problematic 'm' content: {m[:200]}...")
+                    logger.debug("[bing_image_scraper] JSON decode error in container %d: %s (content: %.200s...)", i, e, m)
                 except Exception as e:
-                    print(f"Error processing container {i}: {str(e)}")
+                    logger.debug("[bing_image_scraper] Error processing container %d: %s", i, e)
             
-            print(f"\n=== Found {len(results)} valid image URLs ===")
+            logger.debug("[bing_image_scraper] Found %d valid image URLs", len(results))
             return results
             
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Response status: {e.response.status_code}")
-                print(f"Response headers: {e.response.headers}")
-                print(f"Response content: {e.response.text[:500]}...")
+        except aiohttp.ClientResponseError as e:
+            logger.warning("[bing_image_scraper] Request failed with status %s: %s", e.status, e)
+            logger.debug("[bing_image_scraper] Response headers: %s", e.headers)
+            return []
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("[bing_image_scraper] Request failed: %s", e)
             return []
         except Exception as e:
-            print(f"Unexpected error in bing_image_scraper: {str(e)}")
-            traceback.print_exc()
+            logger.error("[bing_image_scraper] Unexpected error: %s", e, exc_info=True)
             return []
+    @staticmethod
+    async def _read_body(response, max_bytes: int = None, chunk_size: int = 65536) -> bytearray:
+        """
+        Read a response body into one bytearray sized from Content-Length.
+        
+        Avoids response.read()'s chunk list + join, so only one copy of the image is held.
+        Falls back to growing the buffer if the header is missing or wrong (e.g. gzip).
+        Raises ValueError if the body is (or claims to be) larger than max_bytes
+        (config.app.MAX_IMAGE_BYTES by default).
+        """
+        max_bytes = max_bytes or config.app.MAX_IMAGE_BYTES
+        content_length = response.content_length or 0
+        if content_length > max_bytes:
+            raise ValueError(f"Content-Length {content_length} exceeds the {max_bytes} byte limit")
+        # The header comes from a third-party origin: bytearray(n) zero-fills eagerly, so cap it
+        buf = bytearray(min(content_length, max_bytes))
+        offset = 0
+        async for chunk in response.content.iter_chunked(chunk_size):
+            end = offset + len(chunk)
+            if end > max_bytes:
+                raise ValueError(f"Image body exceeds the {max_bytes} byte limit")
+            buf[offset:end] = chunk
+            offset = end
+        del buf[offset:]  # Trim if fewer bytes arrived than advertised
+        return buf
+
+    @staticmethod
+    def _ensure_writable_dir(save_dir: str) -> bool:
+        """Create save_dir if needed and report whether it is writable (blocking; run in an executor)."""
+        os.makedirs(save_dir, exist_ok=True, mode=0o777)
+        return os.access(save_dir, os.W_OK)
+
+    @staticmethod
+    def _reserve_filename(save_dir: str, base_name: str) -> tuple:
+        """
+        Atomically claim a unique '<base_name>_<suffix>.webp' in save_dir.
+        
+        The file is created empty with O_CREAT | O_EXCL, so concurrent saves never pick the
+        same name and no directory scan is needed. Returns a tuple of (filename, filepath).
+        """
+        while True:
+            filename = f"{base_name}_{secrets.token_hex(4)}.webp"
+            filepath = os.path.join(save_dir, filename)
+            try:
+                fd = os.open(filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                continue  # Suffix collision, practically never happens
+            os.close(fd)
+            return filename, filepath
+
     async def save_and_process_image(self, image_url: str, remaining_urls: list = None, profile: str = None, keyword: str = None, max_save: int = None) -> tuple:
             """
-            Save image to disk in WebP format with 65% quality, add watermark if configured,
+            Save image to disk in WebP format with 65% quality (encoder method from config.app.WEBP_METHOD), add watermark if configured,
             and return a tuple of (saved_url, remaining_urls).
             
             Args:
@@ -141,8 +417,6 @@ class ImageScraper:
                     - saved_url: Public URL of the saved image or original URL if save failed
                     - remaining_urls: List of URLs that weren't processed yet
             """
-            logger = logging.getLogger(__name__)
-            
             # Use instance variables if parameters are not provided
             profile = profile or self.profile
             keyword = keyword or self.keyword or 'image'  # Default to 'image' if no keyword provided
@@ -151,193 +425,100 @@ class ImageScraper:
             
             # Check if we've reached the maximum number of images to save
             if hasattr(self, '_saved_count') and max_save is not None and self._saved_count >= max_save:
-                logger.info(f"[save_and_process_image] Reached maximum save limit of {max_save} images")
+                logger.info("[save_and_process_image] Reached maximum save limit of %s images", max_save)
                 return image_url, remaining_urls
                 
             if not profile:
                 raise ValueError("No profile provided and no default profile set in constructor")
             
-            logger.info(f"[save_and_process_image] Starting image processing")
-            logger.info(f"[save_and_process_image] Original URL: {image_url}")
-            logger.info(f"[save_and_process_image] Keyword: {keyword}")
-            logger.info(f"[save_and_process_image] Profile: {profile}")
+            logger.debug("[save_and_process_image] Processing %s (keyword: %s, profile: %s)", image_url, keyword, profile)
             
             # Store the original URL to return if saving fails
             original_url = image_url
-            logger.info(f"[save_and_process_image] Original URL stored: {original_url}")
 
-            # Get save directory from environment or use a default, and format with profile
-            save_dir = os.getenv("IMAGES_SAVE_DIR", "/var/www/{profile}/images").format(profile=profile)
-            logger.info(f"[save_and_process_image] Using save directory: {save_dir}")
+            # Use the save directory resolved in __init__ unless a different profile was passed
+            save_dir = self._save_dir if profile == self.profile else self._format_save_dir(profile)
+            logger.debug("[save_and_process_image] Using save directory: %s", save_dir)
 
-            # Generate a safe filename
-            base_name = re.sub(r'[^a-zA-Z0-9]', '', str(keyword).replace(' ', ''))[:20]
-            filename = f"{base_name}.webp"
-            counter = 1
+            # Generate a safe filename base; the unique suffix is reserved once the download succeeds
+            base_name = _SAFE_NAME_RE.sub('', str(keyword))[:20]
             filepath = ""
-
-            # Check if file exists and find next available filename
-            while True:
-                filepath = os.path.join(save_dir, filename)
-                if not os.path.exists(filepath):
-                    break
-                filename = f"{base_name}{counter}.webp"
-                counter += 1
-
-            logger.info(f"[save_and_process_image] Generated filename: {filename}")
+            
+            loop = asyncio.get_running_loop()
             
             try:
-                # Create directory if it doesn't exist
-                os.makedirs(save_dir, exist_ok=True, mode=0o777)
-                filepath = os.path.join(save_dir, filename)
-                
-                # Check if we have write permissions
-                if not os.access(os.path.dirname(filepath), os.W_OK):
-                    logger.warning(f"No write permissions in directory: {os.path.dirname(filepath)}")
-                    return original_url
+                # Create the directory and check write permissions off the event loop
+                if not await loop.run_in_executor(None, self._ensure_writable_dir, save_dir):
+                    logger.warning("No write permissions in directory: %s", save_dir)
+                    return original_url, remaining_urls
                 
                 # If the URL is a local file path, just return it
                 if image_url.startswith('file://'):
                     local_path = image_url.replace('file://', '')
-                    logger.info(f"[save_and_process_image] Using existing local image: {local_path}")
-                    return local_path  # Return the local path
+                    logger.debug("[save_and_process_image] Using existing local image: %s", local_path)
+                    return local_path, remaining_urls  # Return the local path
                 
-                # Set timeout for the request
-                timeout = aiohttp.ClientTimeout(total=60)  # 60 seconds timeout
+                http = self._require_http()
                 
-                logger.info(f"[save_and_process_image] Attempting to download image from: {image_url}")
-                
-                # Download the image
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.get(image_url) as response:
-                        logger.info(f"[save_and_process_image] Image download status: {response.status}")
+                # Download the image over the shared, pooled session
+                async with http.get(image_url) as response:
+                    logger.debug("[save_and_process_image] Image download status: %s", response.status)
+                    
+                    if response.status != 200:
+                        logger.error("[save_and_process_image] Failed to download image: %s (Status: %s). Using original URL.",
+                                     image_url, response.status)
+                        return original_url, remaining_urls
+                    
+                    # Stream the image data into a single preallocated buffer
+                    img_data = await self._read_body(response)
+                    logger.debug("[save_and_process_image] Read %d bytes of image data", len(img_data))
+                    
+                    filename, filepath = await loop.run_in_executor(None, self._reserve_filename, save_dir, base_name)
+                    logger.debug("[save_and_process_image] Generated filename: %s", filename)
+                    
+                    try:
+                        # Decode, watermark and encode in the process pool so the event loop keeps downloading
+                        await _run_in_process_pool(_encode_and_watermark, img_data, self._watermark_path, filepath)
                         
-                        if response.status != 200:
-                            error_msg = f"Failed to download image: {image_url} (Status: {response.status}). Using original URL."
-                            logger.error(f"[save_and_process_image] {error_msg}")
-                            return original_url
+                        # Return the full public URL with domain
+                        public_url = f"https://{profile}/images/{filename}"  # Adjust this based on your URL structure
                         
-                        # Read the image data
-                        img_data = await response.read()
-                        logger.info(f"[save_and_process_image] Successfully read {len(img_data)} bytes of image data")
+                        # Increment the saved image counter
+                        if not hasattr(self, '_saved_count'):
+                            self._saved_count = 0
+                        self._saved_count += 1
                         
+                        logger.info("[save_and_process_image] Saved %s as %s (%d/%s)", filepath, public_url, self._saved_count, self.max_save)
+                        return public_url, remaining_urls
+                    except Exception as e:
+                        logger.error("[save_and_process_image] Error processing image %s: %s. Using original URL.",
+                                     image_url, e, exc_info=True)
                         try:
-                             
-                            with Image.open(io.BytesIO(img_data)) as img:
-                                logger.info(f"[save_and_process_image] Opened image with mode: {img.mode}, size: {img.size}")
-                                
-                                # Convert to RGB if necessary (for PNG with transparency)
-                                if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                                    logger.info("[save_and_process_image] Converting image from transparent to RGB")
-                                    background = Image.new('RGB', img.size, (255, 255, 255))
-                                    background.paste(img, mask=img.split()[-1])  # Paste using alpha channel as mask
-                                    img = background
-                                
-                                # Save the original image first
-                                with tempfile.NamedTemporaryFile(suffix='.webp', delete=False) as temp_file:
-                                    temp_path = temp_file.name
-                                    img.save(temp_path, format='WEBP', quality=65, method=6)
-                                
-                                # Get the path to the watermark image - first check environment variable, then default location
-                                watermark_path = os.getenv("WATERMARK_IMAGE_PATH")
-                                if not watermark_path or not os.path.exists(watermark_path):
-                                    # Fall back to the default watermark location
-                                    watermark_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'watermark', 'spreadword.webp')
-                                
-                                logger.info(f"[save_and_process_image] Checking watermark at: {watermark_path}")
-                                
-                                if os.path.exists(watermark_path):
-                                    try:
-                                        # Verify the watermark file is readable
-                                        with Image.open(watermark_path) as test_img:
-                                            logger.info(f"[save_and_process_image] Watermark image is valid. Mode: {test_img.mode}, Size: {test_img.size}")
-                                        
-                                        # Create a temporary file for the watermarked image
-                                        with tempfile.NamedTemporaryFile(suffix='.webp', delete=False) as watermarked_temp_file:
-                                            watermarked_path = watermarked_temp_file.name
-                                        
-                                        logger.info(f"[save_and_process_image] Applying watermark from: {watermark_path}")
-                                        logger.info(f"[save_and_process_image] Source image: {temp_path}, Output: {watermarked_path}")
-                                        
-                                        # Apply watermark
-                                        self._add_watermark(temp_path, watermark_path, watermarked_path)
-                                        
-                                        # Verify the watermarked image was created
-                                        if os.path.exists(watermarked_path) and os.path.getsize(watermarked_path) > 0:
-                                            temp_path = watermarked_path  # Use the watermarked image
-                                            logger.info(f"[save_and_process_image] Successfully applied watermark. New temp path: {temp_path}")
-                                        else:
-                                            raise Exception("Watermarked file was not created or is empty")
-                                            
-                                    except Exception as e:
-                                        logger.error(f"[save_and_process_image] Error applying watermark: {str(e)}", exc_info=True)
-                                        # Clean up any partial files
-                                        if 'watermarked_path' in locals() and os.path.exists(watermarked_path):
-                                            try:
-                                                os.unlink(watermarked_path)
-                                            except:
-                                                pass
-                                        # Continue with unwatermarked image if watermarking fails
-                                else:
-                                    logger.warning(f"[save_and_process_image] Watermark file not found at: {watermark_path}")
-                                    logger.info(f"[save_and_process_image] Current working directory: {os.getcwd()}")
-                                    logger.info(f"[save_and_process_image] Directory contents: {os.listdir(os.path.dirname(watermark_path))}")
-                                
-                                # Move the final (watermarked or original) image to the target location
-                                try:
-                                    shutil.move(temp_path, filepath)
-                                    logger.info(f"[save_and_process_image] Successfully saved image to {filepath}")
-                                except Exception as e:
-                                    logger.error(f"[save_and_process_image] Error moving file to {filepath}: {str(e)}")
-                                    return original_url
-                            
-                            # Set proper permissions
-                            os.chmod(filepath, 0o644)
-                            
-                            # Clean up any temporary files that might be left
-                            if os.path.exists(temp_path):
-                                try:
-                                    os.unlink(temp_path)
-                                except:
-                                    pass
-                            
-                            # Return the full public URL with domain
-                            public_url = f"https://{profile}/images/{filename}"  # Adjust this based on your URL structure
-                            
-                            # Increment the saved image counter
-                            if not hasattr(self, '_saved_count'):
-                                self._saved_count = 0
-                            self._saved_count += 1
-                            
-                            logger.info(f"[save_and_process_image] Successfully saved image to {filepath}")
-                            logger.info(f"[save_and_process_image] Public URL: {public_url}")
-                            logger.info(f"[save_and_process_image] Saved {self._saved_count}/{self.max_save} images so far")
-                            return public_url, remaining_urls
-                        except Exception as e:
-                            error_msg = f"Error processing image {image_url}: {str(e)}. Using original URL."
-                            logger.error(f"[save_and_process_image] {error_msg}", exc_info=True)
-                            return original_url, remaining_urls
+                            os.unlink(filepath)  # Drop the reserved (possibly partial) file
+                        except:
+                            pass
+                        return original_url, remaining_urls
         
             except Exception as e:
-                error_msg = f"Error saving image {image_url}: {str(e)}. Using original URL."
-                logger.error(f"[save_and_process_image] {error_msg}", exc_info=True)
+                logger.error("[save_and_process_image] Error saving image %s: %s. Using original URL.",
+                             image_url, e, exc_info=True)
                 return original_url, remaining_urls
                 
             except PermissionError as e:
-                error_msg = f"Permission denied when saving image to directory: {os.path.dirname(filepath) if filepath else 'unknown'}. Error: {str(e)}"
-                logger.error(f"[save_and_process_image] {error_msg}")
+                logger.error("[save_and_process_image] Permission denied when saving image to directory: %s. Error: %s",
+                             os.path.dirname(filepath) if filepath else 'unknown', e)
                 logger.info("[save_and_process_image] Using original URL due to permission error")
 
                 if os.geteuid() == 0:  # If running as root
                     try:
                         os.chmod(save_dir, 0o777)
-                        logger.info(f"[save_and_process_image] Attempted to fix permissions on {save_dir}")
+                        logger.info("[save_and_process_image] Attempted to fix permissions on %s", save_dir)
                     except Exception as perm_error:
-                        logger.error(f"[save_and_process_image] Failed to fix permissions: {str(perm_error)}")
+                        logger.error("[save_and_process_image] Failed to fix permissions: %s", perm_error)
                 return original_url, remaining_urls
                 
             except Exception as e:
-                error_msg = f"Unexpected error processing image {image_url}: {str(e)}"
-                logger.error(f"[save_and_process_image] {error_msg}", exc_info=True)
+                logger.error("[save_and_process_image] Unexpected error processing image %s: %s",
+                             image_url, e, exc_info=True)
                 logger.info("[save_and_process_image] Using original URL due to unexpected error")
                 return original_url, remaining_urls
\ No newline at end of file
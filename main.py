@@ -3,9 +3,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
 import asyncio
-from image_scraper import ImageScraper
-from models import ImageData, init_db, SessionLocal
-from sqlalchemy.orm import Session
+from image_scraper import ImageScraper, shutdown_process_pool
+from models import ImageData, init_db, get_or_create_image_data
+from db_engine import get_db, engine as async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 import uvicorn
 import logging
 from config import global_config as config
@@ -29,33 +30,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 class ScrapeRequest(BaseModel):
     keyword: str
     profile: str
     max_save: int = 2
 
-async def get_or_create_keyword(db: Session, keyword: str) -> ImageData:
-    """Get existing keyword or create a new one"""
-    db_keyword = db.query(ImageData).filter(ImageData.keyword == keyword.lower()).first()
-    if not db_keyword:
-        db_keyword = ImageData(keyword=keyword.lower())
-        db.add(db_keyword)
-        db.commit()
-        db.refresh(db_keyword)
+async def get_or_create_keyword(db: AsyncSession, keyword: str) -> ImageData:
+    """Get existing keyword or create a new one (models.get_or_create_image_data), then commit"""
+    db_keyword = await db.run_sync(get_or_create_image_data, keyword.lower())
+    # Commit right away so the upsert's row lock isn't held through the scrape
+    await db.commit()
     return db_keyword
 
 @app.post("/scrape-images/")
 async def scrape_images(
     request: ScrapeRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Scrape and save images based on the provided keyword.
@@ -74,42 +64,51 @@ async def scrape_images(
         # Get or create keyword in database
         db_keyword = await get_or_create_keyword(db, request.keyword)
         
-        # Initialize the scraper
-        scraper = ImageScraper(
+        # Initialize the scraper; its HTTP session is shared by the search and every download
+        async with ImageScraper(
             profile=request.profile,
             keyword=request.keyword,
             max_save=request.max_save
-        )
-        
-        # If no scraped URLs in DB, fetch new ones
-        if not db_keyword.scraped_urls and not db_keyword.processed_urls:
-            logger.info("No existing URLs found, scraping new images...")
-            new_urls = scraper.bing_image_scraper()
-            db_keyword.scraped_urls = new_urls
-            db.commit()
+        ) as scraper:
+            # If no URLs in DB, fetch new ones
+            if not await db.run_sync(db_keyword.has_urls):
+                logger.info("No existing URLs found, scraping new images...")
+                new_urls = await scraper.bing_image_scraper()
+                await db.run_sync(db_keyword.add_scraped_urls, new_urls)
+                await db.commit()
+            
+            # Get URLs to process (prefer unprocessed, then random from processed)
+            urls_to_process = await db.run_sync(db_keyword.get_urls_to_process, request.max_save)
+            # Never download the same URL twice in one request (order preserved)
+            urls_to_process = list(dict.fromkeys(urls_to_process))
+            
+            if not urls_to_process:
+                return {
+                    "status": "success",
+                    "message": "No more images to process",
+                    "saved_urls": [],
+                    "remaining_urls": []
+                }
+            
+            # Process the selected URLs concurrently
+            results = await asyncio.gather(
+                *(scraper.save_and_process_image(u) for u in urls_to_process),
+                return_exceptions=True
+            )
         
-        # Get URLs to process (prefer unprocessed, then random from processed)
-        urls_to_process, remaining_urls = db_keyword.get_urls_to_process(request.max_save)
-        
-        if not urls_to_process:
-            return {
-                "status": "success",
-                "message": "No more images to process",
-                "saved_urls": [],
-                "remaining_urls": []
-            }
-        
-        # Process the selected URLs
         saved_urls = []
-        for url in urls_to_process:
-            saved_url, _ = await scraper.save_and_process_image(url)
+        for url, result in zip(urls_to_process, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error processing {url}: {result}", exc_info=result)
+                continue
+            saved_url, _ = result
             if saved_url and saved_url != url:  # Only add if save was successful
                 saved_urls.append(saved_url)
         
         # Update database
-        db_keyword.mark_as_processed(urls_to_process)
-        db_keyword.scraped_urls = remaining_urls
-        db.commit()
+        await db.run_sync(db_keyword.mark_as_processed, urls_to_process)
+        remaining_urls = await db.run_sync(db_keyword.get_scraped_urls)
+        await db.commit()
         
         return {
             "status": "success",
@@ -121,9 +120,15 @@ async def scrape_images(
         
     except Exception as e:
         logger.error(f"Error in scrape_images: {str(e)}", exc_info=True)
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the image processing worker pool and close pooled DB connections"""
+    shutdown_process_pool()
+    await async_engine.dispose()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -1,6 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, JSON
+import hashlib
+import threading
+from cachetools import TTLCache
+from sqlalchemy import (create_engine, event, inspect, text, func, select, bindparam, lambda_stmt,
+                        Column, Integer, BigInteger, String, DateTime, ForeignKey, Index,
+                        UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from config import global_config as config
 
 # Create SQLAlchemy engine and session
@@ -9,76 +18,363 @@ Base = declarative_base()
 # Get database URL from config
 DATABASE_URL = config.db.DATABASE_URL
 
+# ImageUrl.status values
+URL_SCRAPED = 'scraped'      # Scraped but not processed yet
+URL_PROCESSED = 'processed'  # Already processed/saved at least once
+
+# image_url.url column size; longer URLs are skipped instead of failing the whole insert
+MAX_URL_LENGTH = 2048
+
+
+def keyword_hash(keyword: str) -> int:
+    """Signed 64-bit blake2b hash of a keyword, used as a compact index key"""
+    return int.from_bytes(hashlib.blake2b(keyword.encode(), digest_size=8).digest(), 'little', signed=True)
+
+def _keyword_hash_default(context):
+    # Column default, so ORM adds and single-row Core upserts are populated too
+    return keyword_hash(context.get_current_parameters()['keyword'])
+
 
 class ImageData(Base):
     __tablename__ = 'image_data'
     
     id = Column(Integer, primary_key=True)
     keyword = Column(String(255), unique=True, nullable=False, index=True)
-    scraped_urls = Column(JSON, default=list)  # List of scraped but unprocessed URLs
-    processed_urls = Column(JSON, default=list)  # List of already processed/saved URLs
+    # Narrow lookups through the 8-byte hash; keyword itself still tie-breaks collisions
+    keyword_hash = Column(BigInteger, index=True, default=_keyword_hash_default)
+    # Denormalized image_url counts, kept in step by add_scraped_urls/mark_as_processed
+    scraped_count = Column(Integer, nullable=False, default=0, server_default='0')
+    processed_count = Column(Integer, nullable=False, default=0, server_default='0')
     
     def __repr__(self):
-        return f"<ImageData(keyword='{self.keyword}', scraped={len(self.scraped_urls)}, processed={len(self.processed_urls)})>"
+        return (f"<ImageData(keyword='{self.keyword}', scraped={self.scraped_count}, "
+                f"processed={self.processed_count})>")
+    
+    def _bump_counts(self, session, scraped: int, processed: int = 0):
+        # Relative UPDATE so concurrent writers don't overwrite each other's counts
+        session.query(ImageData).filter(ImageData.id == self.id).update({
+            ImageData.scraped_count: ImageData.scraped_count + scraped,
+            ImageData.processed_count: ImageData.processed_count + processed,
+        }, synchronize_session='evaluate')
+    
+    def has_urls(self, session) -> bool:
+        """Whether any URL (scraped or processed) has been stored for this keyword"""
+        return session.query(ImageUrl.id).filter_by(keyword_id=self.id).first() is not None
+    
+    def add_scraped_urls(self, session, urls: list[str]):
+        """
+        Store newly scraped URLs as unprocessed in one INSERT ... ON CONFLICT DO NOTHING;
+        URLs already stored for this keyword (in any status) are skipped by the database,
+        URLs longer than MAX_URL_LENGTH are dropped.
+        """
+        urls = [url for url in dict.fromkeys(urls) if len(url) <= MAX_URL_LENGTH]
+        if not urls:
+            return
+        insert = pg_insert if session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+        inserted = session.execute(
+            insert(ImageUrl)
+            .values([{'keyword_id': self.id, 'url': url, 'status': URL_SCRAPED} for url in urls])
+            .on_conflict_do_nothing(index_elements=['keyword_id', 'url'])
+        ).rowcount
+        if inserted:
+            self._bump_counts(session, inserted)
         
-    def get_urls_to_process(self, count: int) -> tuple[list, list]:
+    def iter_urls_to_process(self, session, count: int):
         """
-        Get URLs to process, with preference for unprocessed URLs first.
-        Returns a tuple of (urls_to_process, updated_scraped_urls)
+        Yield up to `count` URLs to process, with preference for unprocessed URLs first
+        (oldest first), topped up with random already-processed URLs.
+        
+        Lazy: the processed top-up query only runs if the caller reads past the unprocessed ones.
         """
-        # First take from scraped_urls
-        to_process = self.scraped_urls[:count]
-        remaining = self.scraped_urls[count:]
+        yielded = 0
+        for (url,) in (session.query(ImageUrl.url)
+                       .filter_by(keyword_id=self.id, status=URL_SCRAPED)
+                       .order_by(ImageUrl.id)
+                       .limit(count)):
+            yielded += 1
+            yield url
         
-        # If we need more, take from processed_urls
-        remaining_count = count - len(to_process)
-        if remaining_count > 0 and self.processed_urls:
-            # Take random samples if we have enough, otherwise take all
-            import random
-            available = min(remaining_count, len(self.processed_urls))
-            random_processed = random.sample(self.processed_urls, available)
-            to_process.extend(random_processed)
-            
-        return to_process, remaining
-    
-    def mark_as_processed(self, urls: list[str]):
-        """Mark URLs as processed (move from scraped to processed)"""
-        # Remove from scraped_urls
-        self.scraped_urls = [url for url in self.scraped_urls if url not in urls]
-        # Add to processed_urls if not already there
-        for url in urls:
-            if url not in self.processed_urls:
-                self.processed_urls.append(url)
+        # If we need more, take random samples from processed URLs
+        remaining_count = count - yielded
+        if remaining_count > 0:
+            for (url,) in (session.query(ImageUrl.url)
+                           .filter_by(keyword_id=self.id, status=URL_PROCESSED)
+                           .order_by(func.random())
+                           .limit(remaining_count)):
+                yield url
+    
+    def get_urls_to_process(self, session, count: int) -> list[str]:
+        """List form of iter_urls_to_process"""
+        return list(self.iter_urls_to_process(session, count))
+    
+    def get_scraped_urls(self, session) -> list[str]:
+        """All URLs still waiting to be processed, oldest first"""
+        return [
+            url for (url,) in session.query(ImageUrl.url)
+            .filter_by(keyword_id=self.id, status=URL_SCRAPED)
+            .order_by(ImageUrl.id)
+        ]
+    
+    def mark_as_processed(self, session, urls: list[str]):
+        """Mark URLs as processed with a single UPDATE"""
+        # Duplicates add nothing to the IN list, and rows that are already processed
+        # (the random top-ups) are skipped instead of being rewritten
+        urls = set(urls)
+        if not urls:
+            return
+        updated = session.query(ImageUrl).filter(
+            ImageUrl.keyword_id == self.id,
+            ImageUrl.status == URL_SCRAPED,
+            ImageUrl.url.in_(urls)
+        ).update({'status': URL_PROCESSED}, synchronize_session=False)
+        if updated:
+            self._bump_counts(session, -updated, updated)
+
+
+class ImageUrl(Base):
+    __tablename__ = 'image_url'
+    __table_args__ = (
+        # Serves "next N scraped/processed URLs for a keyword" (and keyword_id-only lookups)
+        Index('ix_keyword_status', 'keyword_id', 'status'),
+        UniqueConstraint('keyword_id', 'url', name='uq_keyword_url'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    keyword_id = Column(Integer, ForeignKey('image_data.id', ondelete='CASCADE'), nullable=False)
+    url = Column(String(MAX_URL_LENGTH), nullable=False)
+    status = Column(String(16), nullable=False, default=URL_SCRAPED)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    
+    def __repr__(self):
+        return f"<ImageUrl(keyword_id={self.keyword_id}, status='{self.status}', url='{self.url}')>"
+
+
+def _migrate_json_urls(conn):
+    """
+    Copy URLs from the legacy image_data.scraped_urls/processed_urls JSON columns into image_url.
+    
+    Only runs right after image_url is created, in the same transaction, so a failed copy
+    also rolls back the table and is retried on the next start. URLs longer than
+    MAX_URL_LENGTH are skipped; the legacy columns are left in place.
+    """
+    columns = {col['name'] for col in inspect(conn).get_columns('image_data')}
+    if conn.dialect.name != 'postgresql' or not {'scraped_urls', 'processed_urls'} <= columns:
+        return
+    # Processed first so a URL present in both lists keeps the processed status
+    for column, status in (('processed_urls', URL_PROCESSED), ('scraped_urls', URL_SCRAPED)):
+        conn.execute(text(
+            f"INSERT INTO image_url (keyword_id, url, status) "
+            f"SELECT d.id, u.url, :status FROM image_data d, "
+            f"json_array_elements_text(COALESCE(d.{column}::json, '[]'::json)) AS u(url) "
+            f"WHERE length(u.url) <= :max_length "
+            f"ON CONFLICT DO NOTHING"
+        ), {'status': status, 'max_length': MAX_URL_LENGTH})
+    _recount_urls(conn)
+
+def _recount_urls(conn):
+    """Recompute image_data.scraped_count/processed_count from image_url"""
+    conn.execute(text(
+        "UPDATE image_data SET "
+        "scraped_count = (SELECT count(*) FROM image_url u WHERE u.keyword_id = image_data.id AND u.status = :scraped), "
+        "processed_count = (SELECT count(*) FROM image_url u WHERE u.keyword_id = image_data.id AND u.status = :processed)"
+    ), {'scraped': URL_SCRAPED, 'processed': URL_PROCESSED})
+
+def _add_missing_columns(conn):
+    """
+    Add model columns missing from tables created by an older version (create_all never alters).
+    
+    Also creates their indexes and backfills image_data.keyword_hash and the URL counts
+    for existing rows.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        added = [column for column in table.columns if column.name not in existing]
+        added_names = {column.name for column in added}
+        for column in added:
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            conn.execute(text(ddl))
+        for index in table.indexes:
+            if added_names & {column.name for column in index.columns}:
+                index.create(conn, checkfirst=True)
+        if table is ImageData.__table__ and 'keyword_hash' in added_names:
+            rows = conn.execute(text("SELECT id, keyword FROM image_data")).all()
+            if rows:
+                conn.execute(
+                    text("UPDATE image_data SET keyword_hash = :h WHERE id = :id"),
+                    [{'h': keyword_hash(keyword), 'id': pk} for pk, keyword in rows],
+                )
+        if table is ImageData.__table__ and {'scraped_count', 'processed_count'} & added_names:
+            _recount_urls(conn)
+
+def _engine_kwargs(db_url: str) -> dict:
+    """Pool settings for create_engine: a sized QueuePool, or SQLAlchemy's SQLite defaults"""
+    url = make_url(db_url)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory':
+            # An in-memory database only exists on its connection, so every checkout shares one
+            return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+        # File databases keep a connection (and transaction) per checkout, so scoped sessions stay isolated
+        return {'connect_args': {'check_same_thread': False}}
+    return {
+        'poolclass': QueuePool,
+        'pool_pre_ping': True,
+        'pool_size': config.db.POOL_SIZE,
+        'max_overflow': config.db.MAX_OVERFLOW,
+        'pool_timeout': config.db.POOL_TIMEOUT,
+        'pool_recycle': config.db.POOL_RECYCLE,
+    }
+
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    # WAL lets readers run alongside the writer; NORMAL syncs at checkpoints instead of every commit
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+def _create_engine(db_url: str):
+    new_engine = create_engine(db_url, **_engine_kwargs(db_url))
+    if new_engine.dialect.name == 'sqlite':
+        event.listen(new_engine, 'connect', _sqlite_pragmas)
+    return new_engine
 
 # Create database engine and session
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = _create_engine(DATABASE_URL)
+# One session per thread, so a whole scrape batch shares its identity map (see remove_session).
+# expire_on_commit=False keeps objects usable after commit without a reload SELECT; the
+# trade-off is that they can go stale across commits, so session.refresh(obj) where that matters.
+SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine))
+
+def remove_session():
+    """Close and discard the current thread's session; call from worker teardown"""
+    SessionLocal.remove()
+
+# Database URLs whose tables have already been created in this process (strings, so
+# replaced engines aren't kept alive)
+_initialized = set()
 
 def init_db(db_url=None):
-    """Initialize the database and create tables"""
-    db_url = db_url or DATABASE_URL
-    engine = create_engine(db_url, pool_pre_ping=True)
+    """
+    Initialize the database and create tables.
     
-    # Create tables if they don't exist
-    Base.metadata.create_all(engine)
+    Reuses the module-level engine (and its pooled connections) unless a different
+    db_url is given, and only runs the schema check once per database URL. Returns the
+    current thread's scoped session.
+    """
+    global engine
+    if db_url and engine.url.render_as_string(hide_password=False) != db_url:
+        # Drop the session bound to the old engine, then rebind the ones created from now on
+        SessionLocal.remove()
+        # Close the old engine's pooled connections instead of leaving them open; that also
+        # loses an in-memory database, so its schema is checked again if it comes back
+        engine.dispose()
+        _initialized.discard(engine.url.render_as_string(hide_password=False))
+        engine = _create_engine(db_url)
+        SessionLocal.configure(bind=engine)
     
-    # Create a configured "Session" class
-    SessionLocal.configure(bind=engine)
+    # Create tables if they don't exist
+    url_key = engine.url.render_as_string(hide_password=False)
+    if url_key not in _initialized:
+        # One transaction, so a failed upgrade or JSON copy leaves nothing half-done to skip next time
+        with engine.begin() as conn:
+            had_url_table = inspect(conn).has_table(ImageUrl.__tablename__)
+            Base.metadata.create_all(conn)
+            _add_missing_columns(conn)
+            if not had_url_table:
+                _migrate_json_urls(conn)
+        _initialized.add(url_key)
     
     return SessionLocal()
 
+# Built once so every call reuses the cached compiled statement
+_GET_BY_KEYWORD = (
+    select(ImageData)
+    .where(ImageData.keyword_hash == bindparam('h'), ImageData.keyword == bindparam('k'))
+    .limit(1)
+)
+
+# (database url, keyword) -> ImageData.id for recently used keywords; cachetools caches
+# are not thread-safe, so every access goes through the lock
+_keyword_id_cache = TTLCache(maxsize=10_000, ttl=60)
+_keyword_id_lock = threading.Lock()
+
 def get_or_create_image_data(session, keyword):
-    """Get or create an ImageData record"""
-    data = session.query(ImageData).filter_by(keyword=keyword).first()
-    if not data:
-        data = ImageData(keyword=keyword, scraped_urls=[], processed_urls=[])
-        session.add(data)
-        session.commit()
+    """
+    Get or create an ImageData record with an atomic upsert (safe under concurrent scrapers).
+    
+    Recently seen keywords are resolved through a short-lived id cache and session.get, which
+    is served from the identity map or a primary-key SELECT instead of the upsert.
+    Does not commit; the caller owns the transaction boundary.
+    """
+    cache_key = (session.get_bind().url, keyword)
+    with _keyword_id_lock:
+        pk = _keyword_id_cache.get(cache_key)
+    if pk is not None:
+        data = session.get(ImageData, pk)
+        # The id may be gone (rolled back or deleted) or even reused by another keyword
+        if data is not None and data.keyword == keyword:
+            return data
+    data = _upsert_image_data(session, keyword)
+    with _keyword_id_lock:
+        _keyword_id_cache[cache_key] = data.id
     return data
 
+def _upsert_image_data(session, keyword):
+    if session.get_bind().dialect.name == 'postgresql':
+        # One round-trip that both creates and returns the row
+        stmt = (
+            pg_insert(ImageData)
+            .values(keyword=keyword)
+            .on_conflict_do_update(index_elements=['keyword'], set_={'keyword': keyword})
+            .returning(ImageData)
+        )
+        return session.scalars(stmt).one()
+    
+    # SQLite: insert-if-missing, then read the row back
+    session.execute(sqlite_insert(ImageData).values(keyword=keyword).on_conflict_do_nothing())
+    return session.execute(_GET_BY_KEYWORD, {'h': keyword_hash(keyword), 'k': keyword}).scalar_one()
+
+def _query_keywords(session, keywords):
+    # lambda_stmt caches the compiled SELECT; the lists become expanding IN parameters
+    hashes = [keyword_hash(keyword) for keyword in keywords]
+    stmt = lambda_stmt(lambda: select(ImageData))
+    stmt += lambda s: s.where(ImageData.keyword_hash.in_(hashes), ImageData.keyword.in_(keywords))
+    return session.scalars(stmt)
+
+def get_or_create_many(session, keywords):
+    """
+    Get or create ImageData records for many keywords at once and return {keyword: ImageData}.
+    
+    One SELECT for the existing rows, one multi-row INSERT ... ON CONFLICT DO NOTHING for the
+    missing ones and one SELECT to read them back, instead of a round-trip per keyword.
+    Does not commit; the caller owns the transaction boundary.
+    """
+    keywords = list(dict.fromkeys(keywords))
+    if not keywords:
+        return {}
+    
+    found = {data.keyword: data for data in _query_keywords(session, keywords)}
+    missing = [keyword for keyword in keywords if keyword not in found]
+    if missing:
+        insert = pg_insert if session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+        session.execute(insert(ImageData).values(
+            [{'keyword': keyword, 'keyword_hash': keyword_hash(keyword)} for keyword in missing]
+        ).on_conflict_do_nothing())
+        found.update(
+            (data.keyword, data) for data in _query_keywords(session, missing)
+        )
+    return found
+
 # Example usage:
 # session = init_db()
 # data = get_or_create_image_data(session, "cats")
-# data.scraped_urls.append("http://example.com/cat1.jpg")
-# data.processed_urls.append("http://example.com/processed/cat1.jpg")
 # session.commit()
+# data.add_scraped_urls(session, ["http://example.com/cat1.jpg"])
+# urls = data.get_urls_to_process(session, 2)
+# data.mark_as_processed(session, urls)
+# session.commit()
+# remove_session()